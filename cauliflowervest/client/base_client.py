@@ -14,13 +14,14 @@
 
 """Base CauliflowerVestClient class."""
 
+import functools
 import httplib
 import json
 import logging
+from multiprocessing import pool
 import ssl
 import time
 import urllib
-import urllib2
 import webbrowser
 
 
@@ -28,7 +29,8 @@ import webbrowser
 import httplib2
 import oauth2client.client
 import oauth2client.tools
-
+import requests
+from urllib3.util import retry
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.client import settings
@@ -37,6 +39,28 @@ from cauliflowervest.client import util
 # Prefix to prevent Cross Site Script Inclusion.
 JSON_PREFIX = ")]}',\n"
 
+# Connections kept open per host, and threads used by batch requests.
+MAX_CONNECTIONS = 16
+
+# HTTP status codes the opener retries at the transport layer.
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Bytes read at a time from streamed response bodies.
+_CHUNK_SIZE = 65536
+
+# Decoder and whitespace pattern used to parse JSON past JSON_PREFIX.
+_json_decoder = json.JSONDecoder()
+_JSON_WHITESPACE = json.decoder.WHITESPACE
+
+# Extra headers sent with passphrase uploads.
+_UPLOAD_HEADERS = {'Content-Type': 'application/octet-stream'}
+
+# httplib2.Http shared by OAuth token exchanges; see _GetHttp().
+_http = None
+
+# SSLContext shared by all openers; see _GetSslContext().
+_ssl_context = None
+
 
 class Error(Exception):
   """Class for domain specific exceptions."""
@@ -62,6 +86,64 @@ class MetadataError(Error):
   """There was an error with machine metadata."""
 
 
+def _FormatRequestException(e):
+  """Returns a message for a requests exception, with any server error body."""
+  if isinstance(e, requests.HTTPError) and e.response is not None:
+    try:
+      # Streamed error bodies are only downloaded here.
+      content = e.response.content
+    except requests.RequestException:
+      return str(e)
+    return 'HTTP Error %d: %s: %s' % (
+        e.response.status_code, e.response.reason, content)
+  return str(e)
+
+
+def _EncodeParams(params):
+  """Returns params with values as urllib.urlencode would send them.
+
+  requests drops None values from params; urlencode sends str(value), so
+  e.g. a missing hostname is still sent as 'None'. Unicode values are
+  encoded to UTF-8.
+  """
+  return dict(
+      (k, v.encode('utf-8') if isinstance(v, unicode) else str(v))
+      for k, v in params.iteritems())
+
+
+def _ReadSafeJson(response):
+  """Reads and decodes a streamed response body guarded by JSON_PREFIX.
+
+  The prefix is checked before the rest of the body is downloaded. The body
+  is joined into one string, which is then decoded from just past the prefix
+  rather than from a sliced copy.
+
+  Args:
+    response: requests.Response, requested with stream=True.
+  Returns:
+    The decoded JSON value.
+  Raises:
+    RequestError: the body does not start with JSON_PREFIX.
+    ValueError: the body is not valid JSON.
+  """
+  chunks = response.iter_content(chunk_size=_CHUNK_SIZE)
+  head = []
+  for chunk in chunks:
+    head.append(chunk)
+    if sum(len(c) for c in head) >= len(JSON_PREFIX):
+      break
+  content = ''.join(head)
+  if not content.startswith(JSON_PREFIX):
+    response.close()
+    raise RequestError('Expected JSON prefix missing.')
+  content = ''.join([content] + list(chunks))
+
+  start = _JSON_WHITESPACE.match(content, len(JSON_PREFIX)).end()
+  value, end = _json_decoder.raw_decode(content, start)
+  if _JSON_WHITESPACE.match(content, end).end() != len(content):
+    raise ValueError('Extra data after JSON value.')
+  return value
+
 
 
 class CauliflowerVestClient(object):
@@ -70,25 +152,41 @@ class CauliflowerVestClient(object):
   ESCROW_PATH = None  # String path to escrow to, set by subclasses.
 
   # Sequence of key names of metadata to require; see GetAndValidateMetadata().
-  REQUIRED_METADATA = []
+  REQUIRED_METADATA = ()
 
   # The metadata key under which the passphrase is stored.
   PASSPHRASE_KEY = 'passphrase'
 
-  MAX_TRIES = 5  # Number of times to try an escrow upload.
-  TRY_DELAY_FACTOR = 5  # Number of seconds, (* try_num), to wait between tries.
+  # Number of times to try a request, and the backoff factor in seconds
+  # between tries. BuildOauth2Opener() reads these from this base class for
+  # transport retries, so overriding them in a subclass only affects the 4xx
+  # retries in _RetryRequest().
+  MAX_TRIES = 5
+  TRY_DELAY_FACTOR = 5
 
   XSRF_PATH = '/xsrf-token/%s'
+  REKEY_REQUIRED_PATH = '/api/v1/rekey-required/'
+  # Seconds to reuse a fetched XSRF token. The server accepts tokens for 300
+  # seconds; this leaves room for the opener's retry backoff (see
+  # BuildOauth2Opener()) and the retry_4xx sleeps in _RetryRequest().
+  XSRF_TOKEN_CACHE_SECONDS = 120
 
   def __init__(self, base_url, opener, headers=None):
     self._metadata = None
+    self._xsrf_tokens = {}  # action: (token, time fetched).
     self.base_url = base_url
     self.xsrf_url = util.JoinURL(base_url, self.XSRF_PATH)
     if self.ESCROW_PATH is None:
       raise ValueError('ESCROW_PATH must be set by CauliflowerVestClient subclasses.')
     self.escrow_url = util.JoinURL(base_url, self.ESCROW_PATH)
+    # Joined with a trailing slash, so only target IDs need to be appended.
+    self._rekey_url_prefix = util.JoinURL(
+        base_url, self.REKEY_REQUIRED_PATH, self.ESCROW_PATH, '')
     self.opener = opener
     self.headers = headers or {}
+    if self.headers:
+      # Attached once here rather than to every request.
+      self.opener.headers.update(self.headers)
 
   def _GetMetadata(self):
     """Returns a dict of key/value metadata pairs."""
@@ -97,6 +195,9 @@ class CauliflowerVestClient(object):
   def RetrieveSecret(self, target_id):
     """Fetches and returns the passphrase.
 
+    Connection errors and 5xx responses are retried with backoff by the
+    opener; see BuildOauth2Opener().
+
     Args:
       target_id: str, Target ID to fetch the passphrase for.
     Returns:
@@ -106,21 +207,21 @@ class CauliflowerVestClient(object):
       NotFoundError: no passphrase was found for the given target_id.
     """
     xsrf_token = self._FetchXsrfToken(base_settings.GET_PASSPHRASE_ACTION)
-    url = '%s?%s' % (util.JoinURL(self.escrow_url, urllib.quote(target_id)),
-                     urllib.urlencode({'xsrf-token': xsrf_token}))
-    request = urllib2.Request(url)
+    url = '%s?xsrf-token=%s' % (
+        util.JoinURL(self.escrow_url, urllib.quote(target_id)),
+        urllib.quote_plus(xsrf_token))
     try:
-      response = self.opener.open(request)
-    except urllib2.URLError as e:  # Parent of urllib2.HTTPError.
-      if isinstance(e, urllib2.HTTPError):
-        e.msg += ': ' + e.read()
-        if e.code == httplib.NOT_FOUND:
-          raise NotFoundError('Failed to retrieve passphrase. %s' % e)
-      raise RequestError('Failed to retrieve passphrase. %s' % e)
-    content = response.read()
-    if not content.startswith(JSON_PREFIX):
-      raise RequestError('Expected JSON prefix missing.')
-    data = json.loads(content[len(JSON_PREFIX):])
+      response = self.opener.get(url, stream=True)
+      response.raise_for_status()
+      # The body is streamed, so a dropped connection surfaces while reading.
+      data = _ReadSafeJson(response)
+    except requests.RequestException as e:  # Parent of requests.HTTPError.
+      message = _FormatRequestException(e)
+      if isinstance(e, requests.HTTPError):
+        self._InvalidateXsrfTokens(e.response)
+        if e.response.status_code == httplib.NOT_FOUND:
+          raise NotFoundError('Failed to retrieve passphrase. %s' % message)
+      raise RequestError('Failed to retrieve passphrase. %s' % message)
     return data[self.PASSPHRASE_KEY]
 
   def GetAndValidateMetadata(self):
@@ -129,48 +230,111 @@ class CauliflowerVestClient(object):
     Raises:
       MetadataError: one or more of the REQUIRED_METADATA were not found.
     """
-    if not self._metadata:
-      self._metadata = self._GetMetadata()
-    for key in self.REQUIRED_METADATA:
-      if not self._metadata.get(key, None):
-        raise MetadataError('Required metadata is not found: %s' % key)
+    metadata = self._metadata
+    if metadata is None:
+      metadata = self._GetMetadata()
+    missing = [k for k in self.REQUIRED_METADATA if not metadata.get(k)]
+    if missing:
+      raise MetadataError(
+          'Required metadata is not found: %s' % ', '.join(missing))
+    self._metadata = metadata
+
+  @property
+  def metadata(self):
+    """Dict of machine metadata, retrieved and validated on first use."""
+    if self._metadata is None:
+      self.GetAndValidateMetadata()
+    return self._metadata
 
   def SetOwner(self, owner):
-    if not self._metadata:
-      self.GetAndValidateMetadata()
-    self._metadata['owner'] = owner
+    self.metadata['owner'] = owner
 
   def _FetchXsrfToken(self, action):
-    request = urllib2.Request(self.xsrf_url % action)
-    response = self._RetryRequest(request, 'Fetching XSRF token')
-    return response.read()
-
-  def _RetryRequest(self, request, description, retry_4xx=False):
-    """Make the given HTTP request, retrying upon failure."""
-    for k, v in self.headers.iteritems():
-      request.add_header(k, v)
+    """Returns an XSRF token for action, reusing a recently fetched one."""
+    token, fetched = self._xsrf_tokens.get(action, (None, 0))
+    if token and time.time() - fetched < self.XSRF_TOKEN_CACHE_SECONDS:
+      return token
+
+    response = self._RetryRequest(
+        'GET', self.xsrf_url % action, 'Fetching XSRF token')
+    self._xsrf_tokens[action] = (response.content, time.time())
+    return response.content
+
+  def _InvalidateXsrfTokens(self, response):
+    """Forgets cached XSRF tokens if the server rejected the request."""
+    if response.status_code == httplib.FORBIDDEN:
+      self._xsrf_tokens.clear()
+
+  def _RetryRequest(self, method, url, description, retry_4xx=False,
+                    headers=None, xsrf_action=None, params=None, **kwargs):
+    """Make the given HTTP request, retrying upon failure.
+
+    Connection errors and RETRY_STATUS_CODES responses are retried with
+    backoff by the opener's transport adapter (see BuildOauth2Opener()); only
+    4xx responses, when retry_4xx is True, are retried here, sleeping
+    (try_num + 1) * TRY_DELAY_FACTOR seconds between tries.
+
+    With xsrf_action, each try sends a current XSRF token for that action,
+    and the first 403 is retried, while tries remain, with a freshly fetched
+    token since the cached one may have expired.
 
+    Args:
+      method: str, HTTP method.
+      url: str, URL to request.
+      description: str, description of the request used in errors and logs.
+      retry_4xx: bool, whether to retry when errors are in the 400-499 range.
+      headers: dict, optional headers to send in addition to the opener's.
+      xsrf_action: str, optional action to send an 'xsrf-token' param for.
+      params: dict, optional query string parameters.
+      **kwargs: passed through to the opener's request() method.
+    Returns:
+      requests.Response for the successful request.
+    Raises:
+      RequestError: the request failed.
+    """
+    xsrf_retried = False
     for try_num in range(self.MAX_TRIES):
+      if xsrf_action:
+        params = dict(params or {})
+        params['xsrf-token'] = self._FetchXsrfToken(xsrf_action)
       try:
-        return self.opener.open(request)
-      except urllib2.URLError as e:  # Parent of urllib2.HTTPError.
-        if isinstance(e, urllib2.HTTPError):
-          e.msg += ': ' + e.read()
-          # Reraise if HTTP 4xx and retry_4xx is False
-          if 400 <= e.code < 500 and not retry_4xx:
-            raise RequestError('%s failed: %s' % (description, e))
-        # Otherwise retry other HTTPError and URLError failures.
-        if try_num == self.MAX_TRIES - 1:
+        response = self.opener.request(
+            method, url, headers=headers, params=params, **kwargs)
+        response.raise_for_status()
+        return response
+      except requests.RequestException as e:  # Parent of requests.HTTPError.
+        message = _FormatRequestException(e)
+        is_4xx = (isinstance(e, requests.HTTPError) and
+                  400 <= e.response.status_code < 500)
+        if is_4xx:
+          self._InvalidateXsrfTokens(e.response)
+          if (xsrf_action and not xsrf_retried and
+              e.response.status_code == httplib.FORBIDDEN and
+              try_num < self.MAX_TRIES - 1):
+            xsrf_retried = True
+            logging.warning(
+                '%s failed with (%s). Retrying with a new XSRF token ...',
+                description, message)
+            continue
+        # Reraise if HTTP 4xx and retry_4xx is False
+        if is_4xx and not retry_4xx:
+          raise RequestError('%s failed: %s' % (description, message))
+        # Anything else has already been retried by the opener.
+        if not is_4xx or try_num == self.MAX_TRIES - 1:
           logging.exception('%s failed permanently.', description)
           raise RequestError(
-              '%s failed permanently: %s' % (description, e))
+              '%s failed permanently: %s' % (description, message))
         logging.warning(
-            '%s failed with (%s). Retrying ...', description, e)
+            '%s failed with (%s). Retrying ...', description, message)
         time.sleep((try_num + 1) * self.TRY_DELAY_FACTOR)
+    raise RequestError('%s failed permanently.' % description)
 
   def IsKeyRotationNeeded(self, target_id, tag='default'):
     """Check whether a key rotation is required.
 
+    Connection errors and 5xx responses are retried with backoff by the
+    opener; see BuildOauth2Opener().
+
     Args:
       target_id: str, Target ID.
       tag: str, passphrase tag.
@@ -179,22 +343,44 @@ class CauliflowerVestClient(object):
     Returns:
       bool: True if a key rotation is required.
     """
-    url = '%s?%s' % (
-        util.JoinURL(
-            self.base_url, '/api/v1/rekey-required/',
-            self.ESCROW_PATH, target_id),
-        urllib.urlencode({'tag': tag}))
-    request = urllib2.Request(url)
+    url = '%s%s?tag=%s' % (
+        self._rekey_url_prefix, urllib.quote(target_id),
+        urllib.quote_plus(tag))
+    try:
+      response = self.opener.get(url, stream=True)
+      response.raise_for_status()
+      # The body is streamed, so a dropped connection surfaces while reading.
+      return _ReadSafeJson(response)
+    except requests.RequestException as e:  # Parent of requests.HTTPError.
+      raise RequestError(
+          'Failed to get status. %s' % _FormatRequestException(e))
+
+  def IsKeyRotationNeededBatch(self, target_ids, tag='default'):
+    """Check concurrently whether key rotations are required.
+
+    Args:
+      target_ids: iterable of str Target IDs.
+      tag: str, passphrase tag.
+    Raises:
+      RequestError: there was an error getting status from server.
+    Returns:
+      dict of Target ID to bool, True if a key rotation is required.
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+      return {}
+
+    # Requests are I/O bound and share the opener's connection pool.
+    workers = pool.ThreadPool(min(MAX_CONNECTIONS, len(target_ids)))
     try:
-      response = self.opener.open(request)
-    except urllib2.URLError as e:  # Parent of urllib2.HTTPError.
-      if isinstance(e, urllib2.HTTPError):
-        e.msg += ': ' + e.read()
-      raise RequestError('Failed to get status. %s' % e)
-    content = response.read()
-    if not content.startswith(JSON_PREFIX):
-      raise RequestError('Expected JSON prefix missing.')
-    return json.loads(content[len(JSON_PREFIX):])
+      results = workers.map(
+          functools.partial(self.IsKeyRotationNeeded, tag=tag), target_ids)
+    except Exception:
+      workers.terminate()
+      raise
+    workers.close()
+    workers.join()
+    return dict(zip(target_ids, results))
 
   def UploadPassphrase(self, target_id, passphrase, retry_4xx=False):
     """Uploads a target_id/passphrase pair with metadata.
@@ -206,51 +392,103 @@ class CauliflowerVestClient(object):
     Raises:
       RequestError: there was an error uploading to the server.
     """
-    xsrf_token = self._FetchXsrfToken(base_settings.SET_PASSPHRASE_ACTION)
+    parameters = self.metadata.copy()
+    parameters['volume_uuid'] = target_id
 
-    # Ugh, urllib2 only does GET and POST?!
-    class PutRequest(urllib2.Request):
+    # The server reads metadata from the query string and the secret from the
+    # body.
+    self._RetryRequest(
+        'PUT', self.escrow_url, 'Uploading passphrase', retry_4xx=retry_4xx,
+        xsrf_action=base_settings.SET_PASSPHRASE_ACTION,
+        params=_EncodeParams(parameters), data=passphrase,
+        headers=_UPLOAD_HEADERS)
 
-      def __init__(self, *args, **kwargs):
-        kwargs.setdefault('headers', {})
-        kwargs['headers']['Content-Type'] = 'application/octet-stream'
-        urllib2.Request.__init__(self, *args, **kwargs)
-        self._method = 'PUT'
 
-      def get_method(self):  # pylint: disable=g-bad-name
-        return 'PUT'
 
-    if not self._metadata:
-      self.GetAndValidateMetadata()
-    parameters = self._metadata.copy()
-    parameters['xsrf-token'] = xsrf_token
-    parameters['volume_uuid'] = target_id
-    url = '%s?%s' % (self.escrow_url, urllib.urlencode(parameters))
 
-    request = PutRequest(url, data=passphrase)
-    self._RetryRequest(request, 'Uploading passphrase', retry_4xx=retry_4xx)
+class _SslContextAdapter(requests.adapters.HTTPAdapter):
+  """HTTPAdapter which verifies servers with a prebuilt ssl.SSLContext."""
 
+  def __init__(self, ssl_context, **kwargs):
+    self._ssl_context = ssl_context
+    super(_SslContextAdapter, self).__init__(**kwargs)
 
+  def init_poolmanager(self, *args, **kwargs):
+    kwargs['ssl_context'] = self._ssl_context
+    return super(_SslContextAdapter, self).init_poolmanager(*args, **kwargs)
 
+  def proxy_manager_for(self, proxy, **proxy_kwargs):
+    proxy_kwargs['ssl_context'] = self._ssl_context
+    return super(_SslContextAdapter, self).proxy_manager_for(
+        proxy, **proxy_kwargs)
 
-def BuildOauth2Opener(credentials):
-  """Produce an OAuth compatible urllib2 OpenerDirective."""
-  context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-  context.options |= ssl.OP_NO_SSLv2
-  context.verify_mode = ssl.CERT_REQUIRED
+  def cert_verify(self, conn, url, verify, cert):
+    # The context already holds the trusted roots; never let urllib3 load a
+    # CA bundle into it for each new connection.
+    conn.cert_reqs = 'CERT_REQUIRED'
+    conn.ca_certs = None
+    conn.ca_cert_dir = None
+
+
+def _GetSslContext():
+  """Returns the process-wide SSLContext trusting only our root CAs.
 
-  ca_certs_file = settings.ROOT_CA_CERT_CHAIN_PEM_FILE_PATH
-  context.load_verify_locations(ca_certs_file)
+  The root CA chain is parsed once, on first use rather than at import, so
+  importing this module does not require the PEM file to exist.
+  """
+  global _ssl_context
+  if _ssl_context is None:
+    context = ssl.create_default_context(
+        cafile=settings.ROOT_CA_CERT_CHAIN_PEM_FILE_PATH)
+    context.options |= (
+        ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_TLSv1 |
+        ssl.OP_NO_TLSv1_1)
+    _ssl_context = context
+  return _ssl_context
+
+
+def BuildOauth2Opener(credentials):
+  """Produce an OAuth compatible requests.Session.
+
+  The session keeps connections alive, so every request made by a client
+  reuses one TCP/TLS connection to the server, including between retries.
+
+  Every GET and PUT made through the session, including RetrieveSecret() and
+  IsKeyRotationNeeded(), retries connection errors and RETRY_STATUS_CODES
+  responses, making up to CauliflowerVestClient.MAX_TRIES attempts. urllib3
+  sleeps 0, 2, 4, 8 ... times TRY_DELAY_FACTOR between attempts; with the
+  defaults that is 0/10/20/40 seconds, so a persistently failing server
+  blocks the caller for about 70 seconds before the request fails.
+  """
+  max_retries = retry.Retry(
+      total=CauliflowerVestClient.MAX_TRIES - 1,
+      backoff_factor=CauliflowerVestClient.TRY_DELAY_FACTOR,
+      status_forcelist=RETRY_STATUS_CODES,
+      allowed_methods=('GET', 'PUT'),
+      raise_on_status=False)
+
+  adapter = _SslContextAdapter(
+      _GetSslContext(), pool_connections=4, pool_maxsize=MAX_CONNECTIONS,
+      max_retries=max_retries)
+  opener = requests.Session()
+  # Mounted for plain HTTP too so retries do not depend on the server URL.
+  opener.mount('https://', adapter)
+  opener.mount('http://', adapter)
 
-  opener = urllib2.build_opener(
-      urllib2.HTTPSHandler(context=context),
-      urllib2.HTTPRedirectHandler())
   h = {}
   credentials.apply(h)
-  opener.addheaders = h.items()
+  opener.headers.update(h)
   return opener
 
 
+def _GetHttp():
+  """Returns the process-wide httplib2.Http used for OAuth requests."""
+  global _http
+  if _http is None:
+    _http = httplib2.Http(ca_certs=settings.ROOT_CA_CERT_CHAIN_PEM_FILE_PATH)
+  return _http
+
+
 def GetOauthCredentials():
   """Create an OAuth2 `Credentials` object."""
   if not base_settings.OAUTH_CLIENT_ID:
@@ -276,9 +514,7 @@ def GetOauthCredentials():
     raise AuthenticationError('Authentication request was rejected.')
 
   try:
-    credentials = flow.step2_exchange(
-        httpd.query_params,
-        http=httplib2.Http(ca_certs=settings.ROOT_CA_CERT_CHAIN_PEM_FILE_PATH))
+    credentials = flow.step2_exchange(httpd.query_params, http=_GetHttp())
   except oauth2client.client.FlowExchangeError as e:
     raise AuthenticationError('Authentication has failed: %s' % e)
   else:
@@ -14,17 +14,18 @@
 
 """Tests for client module."""
 
-import cookielib
 import httplib
+import ssl
 import StringIO
 import time
-import urllib2
 
 
 
 from absl.testing import absltest
 import mock
 import oauth2client.client
+import requests
+from urllib3 import exceptions as urllib3_exceptions
 
 from cauliflowervest.client import base_client
 
@@ -33,15 +34,43 @@ def GetArgFromCallHistory(mock_fn, call_index=0, arg_index=0):
   return mock_fn.call_args_list[call_index][0][arg_index]
 
 
+def _MakeResponse(code, content=''):
+  response = requests.Response()
+  response.status_code = code
+  response.reason = httplib.responses[code]
+  response.raw = StringIO.StringIO(content)
+  return response
+
+
+class _DroppedStream(object):
+  """Raw response stream whose connection drops after the JSON prefix."""
+
+  def stream(self, *unused_args, **unused_kwargs):
+    yield base_client.JSON_PREFIX
+    raise urllib3_exceptions.ProtocolError('Connection broken')
+
+
+def _MakeDroppedResponse(code=httplib.OK):
+  response = _MakeResponse(code)
+  response.raw = _DroppedStream()
+  return response
+
+
 class CauliflowerVestClientTest(absltest.TestCase):
   """Test the base_client.CauliflowerVestClient class."""
 
   def setUp(self):
     super(CauliflowerVestClientTest, self).setUp()
     base_client.CauliflowerVestClient.ESCROW_PATH = 'foobar'
-    self.headers = {'fooheader': 'foovalue'}
-    self.c = base_client.CauliflowerVestClient(
-        'http://example.com', None, headers=self.headers)
+    self.c = base_client.CauliflowerVestClient('http://example.com', None)
+
+  def testHeadersAttachedToOpener(self):
+    opener = requests.Session()
+
+    base_client.CauliflowerVestClient(
+        'http://example.com', opener, headers={'fooheader': 'foovalue'})
+
+    self.assertEqual('foovalue', opener.headers['fooheader'])
 
   def testGetAndValidateMetadata(self):
     self.c.REQUIRED_METADATA = ['foo', 'bar']
@@ -59,104 +88,206 @@ class CauliflowerVestClientTest(absltest.TestCase):
           base_client.MetadataError, r'Required metadata is not found: bar'):
         self.c.GetAndValidateMetadata()
 
+  def testMetadataRetrievedOnce(self):
+    self.c.REQUIRED_METADATA = ['foo']
+
+    with mock.patch.object(
+        self.c, '_GetMetadata', return_value={'foo': 'asdf'}) as get_mock:
+      self.c.SetOwner('someone')
+
+      self.assertEqual({'foo': 'asdf', 'owner': 'someone'}, self.c.metadata)
+      get_mock.assert_called_once_with()
+
+  def testMetadataNotCachedWhenInvalid(self):
+    self.c.REQUIRED_METADATA = ['foo']
+
+    with mock.patch.object(self.c, '_GetMetadata', return_value={}):
+      with self.assertRaises(base_client.MetadataError):
+        self.c.GetAndValidateMetadata()
+      with self.assertRaises(base_client.MetadataError):
+        self.c.SetOwner('someone')
+
+  def testGetAndValidateMetadataReportsAllMissing(self):
+    self.c.REQUIRED_METADATA = ['foo', 'bar', 'baz']
+
+    with mock.patch.object(
+        self.c, '_GetMetadata', return_value={'foo': 'asdf', 'baz': ''}):
+      with self.assertRaisesRegexp(
+          base_client.MetadataError,
+          r'Required metadata is not found: bar, baz'):
+        self.c.GetAndValidateMetadata()
+
   def testRetryRequest(self):
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
-    self.c.opener.open.return_value = httplib.OK
-    mock_request = mock.Mock(spec=base_client.urllib2.Request)
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.return_value = _MakeResponse(httplib.OK)
 
-    ret = self.c._RetryRequest(mock_request, 'foo desc')
+    ret = self.c._RetryRequest('GET', 'http://example.com/foo', 'foo desc')
 
-    self.assertEqual(ret, httplib.OK)
-    for k, v in self.headers.iteritems():
-      mock_request.add_header.assert_called_with(k, v)
+    self.assertEqual(ret.status_code, httplib.OK)
+    self.c.opener.request.assert_called_once_with(
+        'GET', 'http://example.com/foo', headers=None, params=None)
 
-  def testRetryRequestURLError(self):
+  @mock.patch.object(time, 'sleep')
+  def testRetryRequestConnectionError(self, _):
     with mock.patch.object(
-        self.c, 'opener', spec=urllib2.OpenerDirector) as mock_o:
-      mock_o.open.side_effect = base_client.urllib2.URLError('some problem')
-      mock_request = mock.Mock(spec=base_client.urllib2.Request)
+        self.c, 'opener', spec=requests.Session) as mock_o:
+      mock_o.request.side_effect = requests.ConnectionError('some problem')
 
       with self.assertRaisesRegexp(
-          base_client.RequestError,
-          r'foo failed permanently: <urlopen error some problem>'):
-        self.c._RetryRequest(mock_request, 'foo')
+          base_client.RequestError, r'foo failed permanently: some problem'):
+        self.c._RetryRequest('GET', 'http://example.com/foo', 'foo')
 
   def testRetryRequest404(self):
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
-
-    mock_fp = StringIO.StringIO('Detailed error message.')
-    err = base_client.urllib2.HTTPError(
-        'url', 404, httplib.responses[404], {}, mock_fp)
-    self.c.opener.open.side_effect = err
-
-    mock_request = mock.Mock(spec=base_client.urllib2.Request)
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.return_value = _MakeResponse(
+        404, 'Detailed error message.')
 
     with self.assertRaisesRegexp(
         base_client.RequestError,
         r'foo failed: HTTP Error 404: Not Found: Detailed error message.'):
-      self.c._RetryRequest(mock_request, 'foo')
-
-  def testRetryRequest404WithArgument(self):
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
+      self.c._RetryRequest('GET', 'http://example.com/foo', 'foo')
 
-    mock_fp = StringIO.StringIO('Detailed error message.')
-    err = base_client.urllib2.HTTPError(
-        'url', 404, httplib.responses[404], {}, mock_fp)
-    self.c.opener.open.side_effect = [err, httplib.OK]
+  @mock.patch.object(time, 'sleep')
+  def testRetryRequest404WithArgument(self, _):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.side_effect = [
+        _MakeResponse(404, 'Detailed error message.'),
+        _MakeResponse(httplib.OK)]
 
-    mock_request = mock.Mock(spec=base_client.urllib2.Request)
+    ret = self.c._RetryRequest(
+        'GET', 'http://example.com/foo', 'foo', retry_4xx=True)
 
-    self.assertEqual(self.c._RetryRequest(mock_request, 'foo', retry_4xx=True),
-                     httplib.OK)
+    self.assertEqual(ret.status_code, httplib.OK)
 
   @mock.patch.object(time, 'sleep')
   def testRetryRequestRequestError(self, sleep_mock):
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
-    mock_fp = StringIO.StringIO('Detailed error message.')
-    err = base_client.urllib2.HTTPError(
-        'url', 500, httplib.responses[500], {}, mock_fp)
-    self.c.opener.open.side_effect = err
-
-    mock_request = mock.Mock(spec=base_client.urllib2.Request)
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.return_value = _MakeResponse(
+        500, 'Detailed error message.')
 
     with self.assertRaisesRegexp(
         base_client.RequestError,
         r'foo2 failed permanently: HTTP Error 500: Internal Server Error: '
         r'Detailed error message.'):
-      self.c._RetryRequest(mock_request, 'foo2')
+      self.c._RetryRequest('GET', 'http://example.com/foo', 'foo2')
+
+    # 5xx responses are retried by the opener, not the client.
+    self.assertEqual(1, self.c.opener.request.call_count)
+    sleep_mock.assert_not_called()
+
+  @mock.patch.object(time, 'sleep')
+  def testRetryRequest4xxWithArgumentFailsPermanently(self, sleep_mock):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.return_value = _MakeResponse(
+        403, 'Detailed error message.')
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError,
+        r'foo failed permanently: HTTP Error 403: Forbidden: '
+        r'Detailed error message.'):
+      self.c._RetryRequest(
+          'GET', 'http://example.com/foo', 'foo', retry_4xx=True)
 
+    self.assertEqual(self.c.MAX_TRIES, self.c.opener.request.call_count)
     for i in xrange(0, self.c.MAX_TRIES - 1):
       sleep_mock.assert_has_calls(
           [mock.call((i + 1) * self.c.TRY_DELAY_FACTOR)])
 
   def testFetchXsrfToken(self):
-    mock_response = mock.Mock()
-    mock_response.read.return_value = 'mock-xsrf-token'
-
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
-    self.c.opener.open.return_value = mock_response
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.return_value = _MakeResponse(
+        httplib.OK, 'mock-xsrf-token')
 
     self.assertEquals('mock-xsrf-token', self.c._FetchXsrfToken('Action'))
 
-  def testIsKeyRotationNeeded(self):
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
+  def testFetchXsrfTokenCached(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.side_effect = [
+        _MakeResponse(httplib.OK, 'token1'),
+        _MakeResponse(httplib.OK, 'token2'),
+        _MakeResponse(httplib.OK, 'token3')]
+
+    with mock.patch.object(time, 'time', return_value=1000):
+      self.assertEqual('token1', self.c._FetchXsrfToken('Action'))
+      self.assertEqual('token1', self.c._FetchXsrfToken('Action'))
+      self.assertEqual('token2', self.c._FetchXsrfToken('OtherAction'))
+
+    expired = 1000 + self.c.XSRF_TOKEN_CACHE_SECONDS
+    with mock.patch.object(time, 'time', return_value=expired):
+      self.assertEqual('token3', self.c._FetchXsrfToken('Action'))
+
+    self.assertEqual(3, self.c.opener.request.call_count)
 
-    self.c.opener.open.return_value.code = httplib.OK
-    self.c.opener.open.return_value.read.return_value = (
-        base_client.JSON_PREFIX + 'true')
+  def testXsrfTokenInvalidatedOnForbidden(self):
+    self.c._xsrf_tokens['Action'] = ('stale-token', time.time())
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.return_value = _MakeResponse(httplib.FORBIDDEN)
+
+    with self.assertRaises(base_client.RequestError):
+      self.c._RetryRequest('PUT', 'http://example.com/foo', 'foo')
+
+    self.assertEqual({}, self.c._xsrf_tokens)
+
+  def testIsKeyRotationNeeded(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.return_value = _MakeResponse(
+        httplib.OK, base_client.JSON_PREFIX + 'true')
 
     self.assertTrue(self.c.IsKeyRotationNeeded('UUID'))
 
-    self.assertEqual(
+    self.c.opener.get.assert_called_once_with(
         'http://example.com/api/v1/rekey-required/foobar/UUID?tag=default',
-        self.c.opener.open.call_args_list[0][0][0].get_full_url())
+        stream=True)
+
+  def testIsKeyRotationNeededEscapesArguments(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.return_value = _MakeResponse(
+        httplib.OK, base_client.JSON_PREFIX + 'false')
+
+    self.assertFalse(self.c.IsKeyRotationNeeded('UU ID', tag='a&b c'))
+
+    self.assertEqual(
+        'http://example.com/api/v1/rekey-required/foobar/UU%20ID?tag=a%26b+c',
+        GetArgFromCallHistory(self.c.opener.get))
+
+  def testIsKeyRotationNeededBatch(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.side_effect = lambda url, **_: _MakeResponse(
+        httplib.OK,
+        base_client.JSON_PREFIX + ('true' if '/A' in url else 'false'))
+
+    self.assertEqual(
+        {'A1': True, 'B1': False, 'A2': True},
+        self.c.IsKeyRotationNeededBatch(['A1', 'B1', 'A2'], tag='foo'))
+    self.assertEqual(3, self.c.opener.get.call_count)
+
+  def testIsKeyRotationNeededBatchEmpty(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+
+    self.assertEqual({}, self.c.IsKeyRotationNeededBatch([]))
+    self.c.opener.get.assert_not_called()
+
+  def testIsKeyRotationNeededBatchRequestError(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.return_value = _MakeResponse(
+        500, 'Detailed error message.')
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError, r'Failed to get status. HTTP Error 500'):
+      self.c.IsKeyRotationNeededBatch(['A1', 'B1'])
+
+  def testIsKeyRotationNeededMissingJsonPrefix(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.return_value = _MakeResponse(httplib.OK, 'true')
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError, r'Expected JSON prefix missing.'):
+      self.c.IsKeyRotationNeeded('UUID')
 
   def testIsKeyRotationNeededRequestError(self):
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
-    mock_fp = StringIO.StringIO('Detailed error message.')
-    err = base_client.urllib2.HTTPError(
-        'url', 500, httplib.responses[500], {}, mock_fp)
-    self.c.opener.open.side_effect = err
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.return_value = _MakeResponse(
+        500, 'Detailed error message.')
 
     with self.assertRaisesRegexp(
         base_client.RequestError,
@@ -164,17 +295,25 @@ class CauliflowerVestClientTest(absltest.TestCase):
         r'Detailed error message.'):
       self.c.IsKeyRotationNeeded('UUID')
 
-  def testIsKeyRotationNeededURLError(self):
+  def testIsKeyRotationNeededConnectionDropped(self):
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.get.return_value = _MakeDroppedResponse()
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError,
+        r'Failed to get status. .*Connection broken'):
+      self.c.IsKeyRotationNeeded('UUID')
+
+  def testIsKeyRotationNeededConnectionError(self):
     with mock.patch.object(
-        self.c, 'opener', spec=urllib2.OpenerDirector) as mock_o:
-      mock_o.open.side_effect = base_client.urllib2.URLError('some problem')
+        self.c, 'opener', spec=requests.Session) as mock_o:
+      mock_o.get.side_effect = requests.ConnectionError('some problem')
 
       with self.assertRaisesRegexp(
-          base_client.RequestError,
-          r'Failed to get status. <urlopen error some problem>'):
+          base_client.RequestError, r'Failed to get status. some problem'):
         self.c.IsKeyRotationNeeded('UUID')
 
-  def _RetrieveTest(self, code, read=True):
+  def _RetrieveTest(self, code):
     self.volume_uuid = 'foostrvolumeuuid'
     self.passphrase = 'foopassphrase'
     content = '{"passphrase": "%s"}' % self.passphrase
@@ -182,24 +321,21 @@ class CauliflowerVestClientTest(absltest.TestCase):
     self.c._FetchXsrfToken = mock.Mock()
     self.c._FetchXsrfToken.return_value = 'token'
 
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
+    self.c.opener = mock.Mock(spec=requests.Session)
     if code == httplib.OK:
-      mock_response = mock.Mock()
-      self.c.opener.open.return_value = mock_response
-      mock_response.code = code
-      if read:
-        mock_response.read.return_value = base_client.JSON_PREFIX + content
+      self.c.opener.get.return_value = _MakeResponse(
+          code, base_client.JSON_PREFIX + content)
     else:
-      mock_fp = StringIO.StringIO('Detailed error message for %s.' % code)
-      exc = base_client.urllib2.HTTPError(
-          'url', code, httplib.responses[code], {}, mock_fp)
-      self.c.opener.open.side_effect = exc
+      self.c.opener.get.return_value = _MakeResponse(
+          code, 'Detailed error message for %s.' % code)
 
   def testRetrieveSecret(self):
     self._RetrieveTest(httplib.OK)
 
     ret = self.c.RetrieveSecret('foo')
     self.assertEqual(ret, self.passphrase)
+    self.c.opener.get.assert_called_once_with(
+        'http://example.com/foobar/foo?xsrf-token=token', stream=True)
 
     self.assertEqual(
         'RetrieveSecret', GetArgFromCallHistory(self.c._FetchXsrfToken))
@@ -222,17 +358,36 @@ class CauliflowerVestClientTest(absltest.TestCase):
         r'Detailed error message for 403.'):
       self.c.RetrieveSecret(self.volume_uuid)
 
-  def testRetrieveSecretURLError(self):
+  def testRetrieveSecretConnectionError(self):
     with mock.patch.object(
         self.c, '_FetchXsrfToken', return_value='token'), mock.patch.object(
-            self.c, 'opener', spec=urllib2.OpenerDirector) as mock_o:
-      mock_o.open.side_effect = base_client.urllib2.URLError('some problem')
+            self.c, 'opener', spec=requests.Session) as mock_o:
+      mock_o.get.side_effect = requests.ConnectionError('some problem')
 
       with self.assertRaisesRegexp(
           base_client.RequestError,
-          r'Failed to retrieve passphrase. <urlopen error some problem>'):
+          r'Failed to retrieve passphrase. some problem'):
         self.c.RetrieveSecret('SomeVolume')
 
+  def testRetrieveSecretConnectionDropped(self):
+    self._RetrieveTest(httplib.OK)
+    self.c.opener.get.return_value = _MakeDroppedResponse()
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError,
+        r'Failed to retrieve passphrase. .*Connection broken'):
+      self.c.RetrieveSecret(self.volume_uuid)
+
+  def testRetrieveSecretErrorBodyDropped(self):
+    self._RetrieveTest(httplib.OK)
+    self.c.opener.get.return_value = _MakeDroppedResponse(
+        httplib.INTERNAL_SERVER_ERROR)
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError,
+        r'Failed to retrieve passphrase. 500 Server Error'):
+      self.c.RetrieveSecret(self.volume_uuid)
+
   def _UploadTest(self, codes):
     self.c._GetMetadata = mock.Mock(return_value={'foo': 'bar'})
     self.c._FetchXsrfToken = mock.Mock(return_value='token')
@@ -240,37 +395,77 @@ class CauliflowerVestClientTest(absltest.TestCase):
     side_effect = []
     for code in codes:
       if code == httplib.OK:
-        mock_response = mock.Mock()
-        mock_response.code = code
-
-        side_effect.append(mock_response)
+        side_effect.append(_MakeResponse(code))
       else:
-        mock_fp = StringIO.StringIO('Detailed error message for %s.' % code)
-        exc = base_client.urllib2.HTTPError(
-            'url', code, httplib.responses[code], {}, mock_fp)
-        side_effect.append(exc)
+        side_effect.append(
+            _MakeResponse(code, 'Detailed error message for %s.' % code))
 
-    self.c.opener = mock.Mock(spec=urllib2.OpenerDirector)
-    self.c.opener.open.side_effect = side_effect
+    self.c.opener = mock.Mock(spec=requests.Session)
+    self.c.opener.request.side_effect = side_effect
 
   def testUploadPassphrase(self):
     self._UploadTest([httplib.OK])
     self.c.UploadPassphrase('foo', 'bar')
 
     self.c._FetchXsrfToken.assert_called_once_with('UploadPassphrase')
+    self.assertEqual('PUT', GetArgFromCallHistory(self.c.opener.request))
+    self.assertEqual('bar', self.c.opener.request.call_args[1]['data'])
+    self.assertEqual(
+        {'foo': 'bar', 'xsrf-token': 'token', 'volume_uuid': 'foo'},
+        self.c.opener.request.call_args[1]['params'])
+    self.assertEqual(
+        'application/octet-stream',
+        self.c.opener.request.call_args[1]['headers']['Content-Type'])
+
+  def testUploadPassphraseEncodesParams(self):
+    self._UploadTest([httplib.OK])
+    self.c._GetMetadata.return_value = {
+        'hostname': None, 'owner': u'j\xfcrgen'}
+
+    self.c.UploadPassphrase('foo', 'bar')
+
+    request = self.c.opener.request.call_args
+    prepared = requests.Request(
+        'PUT', request[0][1], params=request[1]['params']).prepare()
+    self.assertIn('hostname=None', prepared.url)
+    self.assertIn('owner=j%C3%BCrgen', prepared.url)
 
   @mock.patch.object(time, 'sleep')
   def testUploadPassphraseWithTransientRequestError(self, sleep_mock):
-    self._UploadTest([httplib.INTERNAL_SERVER_ERROR,
-                      httplib.INTERNAL_SERVER_ERROR, httplib.OK])
+    self._UploadTest([httplib.NOT_FOUND, httplib.NOT_FOUND, httplib.OK])
 
-    self.c.UploadPassphrase('foo', 'bar')
+    self.c.UploadPassphrase('foo', 'bar', retry_4xx=True)
 
     self.assertEqual(2, sleep_mock.call_count)
 
+  @mock.patch.object(time, 'sleep')
+  def testUploadPassphraseRefreshesXsrfTokenOnForbidden(self, sleep_mock):
+    self._UploadTest([httplib.FORBIDDEN, httplib.OK])
+    self.c._FetchXsrfToken.side_effect = ['stale', 'fresh']
+
+    self.c.UploadPassphrase('foo', 'bar')
+
+    self.assertEqual(2, self.c._FetchXsrfToken.call_count)
+    self.assertEqual(
+        ['stale', 'fresh'],
+        [c[1]['params']['xsrf-token']
+         for c in self.c.opener.request.call_args_list])
+    sleep_mock.assert_not_called()
+
+  @mock.patch.object(time, 'sleep')
+  def testUploadPassphraseForbiddenOnLastTry(self, _):
+    self._UploadTest([httplib.NOT_FOUND] * 4 + [httplib.FORBIDDEN])
+
+    with self.assertRaisesRegexp(
+        base_client.RequestError,
+        r'Uploading passphrase failed permanently: HTTP Error 403'):
+      self.c.UploadPassphrase('vol', 'pw', retry_4xx=True)
+
+    self.assertEqual(5, self.c.opener.request.call_count)
+
   @mock.patch.object(time, 'sleep')
   def testUploadPassphraseWithRequestError(self, sleep_mock):
-    self._UploadTest([403])
+    self._UploadTest([403, 403])
 
     with self.assertRaisesRegexp(
         base_client.RequestError,
@@ -282,10 +477,7 @@ class CauliflowerVestClientTest(absltest.TestCase):
 
   @mock.patch.object(time, 'sleep')
   def testUploadPassphraseWithServerError(self, sleep_mock):
-    reqs = []
-    for _ in xrange(0, 5):
-      reqs.append(httplib.INTERNAL_SERVER_ERROR)
-    self._UploadTest(reqs)
+    self._UploadTest([httplib.INTERNAL_SERVER_ERROR])
 
     with self.assertRaisesRegexp(
         base_client.RequestError,
@@ -293,21 +485,97 @@ class CauliflowerVestClientTest(absltest.TestCase):
         r'Internal Server Error: Detailed error message for 500.'):
       self.c.UploadPassphrase('foo', 'bar')
 
-    self.assertEqual(4, sleep_mock.call_count)
+    sleep_mock.assert_not_called()
+
+
+
 
+class ReadSafeJsonTest(absltest.TestCase):
 
+  def testMultipleChunks(self):
+    value = 'x' * (2 * base_client._CHUNK_SIZE)
+    response = _MakeResponse(
+        httplib.OK, base_client.JSON_PREFIX + ' {"a": "%s"}\n' % value)
+
+    self.assertEqual({'a': value}, base_client._ReadSafeJson(response))
+
+  def testExtraData(self):
+    response = _MakeResponse(httplib.OK, base_client.JSON_PREFIX + '[1] [2]')
+
+    with self.assertRaises(ValueError):
+      base_client._ReadSafeJson(response)
 
 
 class BuildOauth2OpenerTest(absltest.TestCase):
 
+  def setUp(self):
+    super(BuildOauth2OpenerTest, self).setUp()
+    self.ssl_context = mock.Mock(spec=ssl.SSLContext)
+    patcher = mock.patch.object(
+        base_client, '_GetSslContext', return_value=self.ssl_context)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
   def testSuccess(self):
     creds = mock.Mock(spec=oauth2client.client.Credentials)
 
     opener = base_client.BuildOauth2Opener(creds)
 
-    self.assertIsInstance(opener, urllib2.OpenerDirector)
+    self.assertIsInstance(opener, requests.Session)
     self.assertIsInstance(GetArgFromCallHistory(creds.apply, 0, 0), dict)
 
+  def testRetries(self):
+    creds = mock.Mock(spec=oauth2client.client.Credentials)
+
+    opener = base_client.BuildOauth2Opener(creds)
+
+    max_retries = opener.get_adapter('https://example.com').max_retries
+    self.assertEqual(
+        base_client.CauliflowerVestClient.MAX_TRIES - 1, max_retries.total)
+    self.assertEqual(
+        base_client.CauliflowerVestClient.TRY_DELAY_FACTOR,
+        max_retries.backoff_factor)
+    self.assertTrue(max_retries.is_retry('PUT', 503))
+    self.assertFalse(max_retries.is_retry('PUT', 403))
+    self.assertIs(
+        opener.get_adapter('https://example.com'),
+        opener.get_adapter('http://example.com'))
+
+  def testSslContext(self):
+    creds = mock.Mock(spec=oauth2client.client.Credentials)
+
+    opener = base_client.BuildOauth2Opener(creds)
+
+    adapter = opener.get_adapter('https://example.com')
+    self.assertIs(
+        self.ssl_context,
+        adapter.poolmanager.connection_pool_kw['ssl_context'])
+    conn = mock.Mock()
+    adapter.cert_verify(conn, 'https://example.com', True, None)
+    self.assertEqual('CERT_REQUIRED', conn.cert_reqs)
+    self.assertIsNone(conn.ca_certs)
+
+
+class GetSslContextTest(absltest.TestCase):
+
+  @mock.patch.object(base_client, '_ssl_context', None)
+  @mock.patch.object(ssl, 'create_default_context')
+  def testBuiltOnce(self, create_mock):
+    context = base_client._GetSslContext()
+
+    self.assertIs(context, base_client._GetSslContext())
+    create_mock.assert_called_once_with(
+        cafile=base_client.settings.ROOT_CA_CERT_CHAIN_PEM_FILE_PATH)
+
+
+class GetHttpTest(absltest.TestCase):
+
+  def testReused(self):
+    http = base_client._GetHttp()
+
+    self.assertIsInstance(http, base_client.httplib2.Http)
+    self.assertIs(http, base_client._GetHttp())
+
 
 if __name__ == '__main__':
   absltest.main()
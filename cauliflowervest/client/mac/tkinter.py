@@ -16,13 +16,18 @@
 
 import logging
 import os
-import threading
-import time
+import subprocess
 import urlparse
 
 
 import Tkinter
 
+try:
+  # pylint: disable=g-import-not-at-top,import-error
+  import AppKit  # PyObj-C only.
+except ImportError:
+  AppKit = None
+
 
 from cauliflowervest.client import base_client
 from cauliflowervest.client import settings
@@ -30,29 +35,12 @@ from cauliflowervest.client import util
 from cauliflowervest.client.mac import client
 from cauliflowervest.client.mac import glue
 
-import subprocess
+
 def RunProcess(cmd):
   p = subprocess.Popen(
       cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  stdout, stderr = p.communicate()
-  return stdout, stderr, p.wait()
-
-
-class Countdown(threading.Thread):
-  """Thread to update a Tkinter label with seconds remaining in a countdown."""
-
-  def __init__(self, label=None, seconds=10, termination_callback=None):
-    self.label = label
-    self.seconds = seconds
-    self.original_text = label['text']
-    self.termination_callback = termination_callback
-    super(Countdown, self).__init__()
-
-  def run(self):
-    for remaining in range(self.seconds, 0, -1):
-      self.label['text'] = '%s (%s)' % (self.original_text, remaining)
-      time.sleep(1)
-    self.termination_callback()
+  stdout, stderr = p.communicate()  # Also waits for the process to exit.
+  return stdout, stderr, p.returncode
 
 
 class Gui(object):
@@ -87,10 +75,12 @@ class Gui(object):
     self.root = Tkinter.Tk()
     self.root.title('CauliflowerVest')
     # Set our fixed size, and center on the screen.
+    screen_width = self.root.winfo_screenwidth()
+    screen_height = self.root.winfo_screenheight()
     self.root.geometry('%dx%d+%d+%d' % (
         self.WIDTH, self.HEIGHT,
-        self.root.winfo_screenwidth() / 2 - self.WIDTH / 2,
-        self.root.winfo_screenheight() / 2 - self.HEIGHT / 2,
+        (screen_width - self.WIDTH) // 2,
+        (screen_height - self.HEIGHT) // 2,
         ))
 
     # Override Tk's default error handling.
@@ -98,9 +88,12 @@ class Gui(object):
         lambda _1, exc, *_2, **_3: self.ShowFatalError(exc))
 
     # Lame hack around OSX focus issue.  http://goo.gl/9U0Vg
-    util.Exec((
-        '/usr/bin/osascript', '-e',
-        'tell app "Finder" to set frontmost of process "python" to true'))
+    if AppKit is not None:
+      AppKit.NSApplication.sharedApplication().activateIgnoringOtherApps_(True)
+    else:
+      util.Exec((
+          '/usr/bin/osascript', '-e',
+          'tell app "Finder" to set frontmost of process "python" to true'))
     self.top_frame = None
     self.status_callback = None
 
@@ -188,24 +181,43 @@ class Gui(object):
 
     self._PrepTop(glue.ENCRYPTION_SUCCESS_MESSAGE)
 
-    cmd = ['ps', 'auwx']
-    process_list, unused_err, ret = RunProcess(cmd)
-    finder = '/System/Library/CoreServices/Finder.app/Contents/MacOS/Finder\n'
-    if (ret == 0 and process_list
-        and finder in process_list) or ret != 0:
+    # pgrep exits 1 only when no Finder process is running; on any other
+    # failure assume a GUI session, as restarting is the safe default.
+    _, _, ret = RunProcess(['/usr/bin/pgrep', '-xq', 'Finder'])
+    if ret != 1:
       btn = Tkinter.Button(
           self.top_frame, text='Restart now', command=self._RestartNow)
       btn.pack()
-      countdown = Countdown(label=btn, termination_callback=self._RestartNow)
-      countdown.start()
+      self._StartCountdown(btn, self._RestartNow)
     else:
       btn = Tkinter.Button(self.top_frame, text='OK', command=self.root.quit,
                            default=Tkinter.ACTIVE)
       btn.bind('<Return>', lambda _: self.root.quit())
       btn.pack()
       btn.focus()
-      countdown = Countdown(label=btn, termination_callback=self.root.quit)
-      countdown.start()
+      self._StartCountdown(btn, self.root.quit)
+
+  def _StartCountdown(self, label, termination_callback, seconds=10):
+    """Update a Tkinter label with seconds remaining in a countdown.
+
+    The countdown runs on the Tk event loop, so no other thread touches Tk.
+
+    Args:
+      label: Tkinter widget with a 'text' option to update.
+      termination_callback: callable, called when the countdown ends.
+      seconds: int, length of the countdown.
+    """
+    self._CountdownTick(label, label['text'], seconds, termination_callback)
+
+  def _CountdownTick(self, label, original_text, remaining,
+                     termination_callback):
+    if remaining <= 0:
+      termination_callback()
+      return
+    label['text'] = '%s (%s)' % (original_text, remaining)
+    self.root.after(
+        1000, self._CountdownTick, label, original_text, remaining - 1,
+        termination_callback)
 
   def _EncryptedVolumeAction(self, *unused_args):
     """Action to rotate recovery key on encrypted volume."""
@@ -49,7 +49,8 @@ class GuiOauthTest(unittest.TestCase):
     base_settings.OAUTH_CLIENT_ID = 'stub'
     settings.OAUTH_CLIENT_SECRET = 'stub'
 
-  def testAuthenticateFailBadMetadata(self):
+  @mock.patch.object(base_client, 'BuildOauth2Opener')
+  def testAuthenticateFailBadMetadata(self, _):
     with mock.patch.object(base_client, 'GetOauthCredentials') as _:
       mock_fvc = mock.MagicMock(client.FileVaultClient)
       mock_fvc.GetAndValidateMetadata.side_effect = base_client.MetadataError(
@@ -62,7 +63,8 @@ class GuiOauthTest(unittest.TestCase):
         self.assertEqual(1, cb.call_count)
         self.assertEqual('missing data', cb.call_args[0][0])
 
-  def testAuthenticateSuccess(self):
+  @mock.patch.object(base_client, 'BuildOauth2Opener')
+  def testAuthenticateSuccess(self, _):
     with mock.patch.object(base_client, 'GetOauthCredentials') as _:
       mock_fvc = mock.MagicMock(client.FileVaultClient)
       mock_fvc.GetAndValidateMetadata.return_value = None
@@ -73,5 +75,34 @@ class GuiOauthTest(unittest.TestCase):
         self.assertIsInstance(result, base_client.CauliflowerVestClient)
 
 
+class RunProcessTest(unittest.TestCase):
+
+  def testRunProcess(self):
+    stdout, stderr, ret = tkinter.RunProcess(
+        ['/bin/sh', '-c', 'echo out; echo err >&2; exit 3'])
+
+    self.assertEqual('out\n', stdout)
+    self.assertEqual('err\n', stderr)
+    self.assertEqual(3, ret)
+
+
+class GuiTest(unittest.TestCase):
+  """Test the `Gui` class."""
+
+  def testCountdown(self):
+    gui = _NoGuiOauth()
+    gui.root = mock.Mock()
+    gui.root.after.side_effect = lambda _, func, *args: func(*args)
+    label = {'text': 'Restart now'}
+    cb = mock.Mock()
+
+    gui._StartCountdown(label, cb, seconds=3)
+
+    self.assertEqual(3, gui.root.after.call_count)
+    self.assertEqual(1000, gui.root.after.call_args[0][0])
+    self.assertEqual('Restart now (1)', label['text'])
+    cb.assert_called_once_with()
+
+
 if __name__ == '__main__':
   unittest.main()
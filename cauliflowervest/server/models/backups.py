@@ -47,11 +47,11 @@ class DuplicityKeyPair(base.BasePassphrase,
   ACCESS_ERR_CLS = DuplicityAccessError
   AUDIT_LOG_MODEL = DuplicityAccessLog
   ESCROW_TYPE_NAME = 'duplicity'
-  REQUIRED_PROPERTIES = base_settings.DUPLICITY_REQUIRED_PROPERTIES + [
+  REQUIRED_PROPERTIES = base_settings.DUPLICITY_REQUIRED_PROPERTIES + (
       'key_pair',
       'owners',
       'volume_uuid',
-  ]
+  )
   MUTABLE_PROPERTIES = (
       base.BasePassphrase.MUTABLE_PROPERTIES +
       services.InventoryServiceBackupPassphraseProperties.MUTABLE_PROPERTIES)
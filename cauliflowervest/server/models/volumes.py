@@ -78,8 +78,8 @@ class FileVaultVolume(_BaseVolume):
   AUDIT_LOG_MODEL = FileVaultAccessLog
   ACCESS_ERR_CLS = FileVaultAccessError
   ESCROW_TYPE_NAME = 'filevault'
-  REQUIRED_PROPERTIES = base_settings.FILEVAULT_REQUIRED_PROPERTIES + [
-      'passphrase', 'volume_uuid']
+  REQUIRED_PROPERTIES = base_settings.FILEVAULT_REQUIRED_PROPERTIES + (
+      'passphrase', 'volume_uuid')
   SEARCH_FIELDS = [
       ('owner', 'Owner Username'),
       ('created_by', 'Escrow Username'),
@@ -152,13 +152,13 @@ class LuksVolume(_BaseVolume):
   AUDIT_LOG_MODEL = LuksAccessLog
   ACCESS_ERR_CLS = LuksAccessError
   ESCROW_TYPE_NAME = 'luks'
-  REQUIRED_PROPERTIES = base_settings.LUKS_REQUIRED_PROPERTIES + [
+  REQUIRED_PROPERTIES = base_settings.LUKS_REQUIRED_PROPERTIES + (
       'passphrase',
       'hostname',
       'platform_uuid',
       'owners',
       'volume_uuid',
-  ]
+  )
   SEARCH_FIELDS = [
       ('owner', 'Device Owner'),
       ('hostname', 'Hostname'),
@@ -181,8 +181,8 @@ class ProvisioningVolume(_BaseVolume):
   AUDIT_LOG_MODEL = ProvisioningAccessLog
   ACCESS_ERR_CLS = ProvisioningAccessError
   ESCROW_TYPE_NAME = 'provisioning'
-  REQUIRED_PROPERTIES = base_settings.PROVISIONING_REQUIRED_PROPERTIES + [
-      'passphrase', 'volume_uuid']
+  REQUIRED_PROPERTIES = base_settings.PROVISIONING_REQUIRED_PROPERTIES + (
+      'passphrase', 'volume_uuid')
   SEARCH_FIELDS = [
       ('owner', 'Owner Username'),
       ('created_by', 'Escrow Username'),
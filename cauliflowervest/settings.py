@@ -27,14 +27,14 @@ DOMAIN = 'appspot.com'
 SERVER_HOSTNAME = '%s.%s' % (SUBDOMAIN, DOMAIN)
 SERVER_PORT = 443
 
-BITLOCKER_REQUIRED_PROPERTIES = ['hostname', 'cn']
-DUPLICITY_REQUIRED_PROPERTIES = ['hostname', 'platform_uuid']
-APPLE_FIRMWARE_REQUIRED_PROPERTIES = ['hostname', 'platform_uuid', 'serial']
-LINUX_FIRMWARE_REQUIRED_PROPERTIES = ['hostname', 'machine_uuid', 'serial']
-WINDOWS_FIRMWARE_REQUIRED_PROPERTIES = ['hostname', 'smbios_guid', 'serial']
-FILEVAULT_REQUIRED_PROPERTIES = ['hdd_serial', 'platform_uuid', 'serial']
-LUKS_REQUIRED_PROPERTIES = ['hdd_serial', 'platform_uuid']
-PROVISIONING_REQUIRED_PROPERTIES = ['hdd_serial', 'platform_uuid', 'serial']
+BITLOCKER_REQUIRED_PROPERTIES = ('hostname', 'cn')
+DUPLICITY_REQUIRED_PROPERTIES = ('hostname', 'platform_uuid')
+APPLE_FIRMWARE_REQUIRED_PROPERTIES = ('hostname', 'platform_uuid', 'serial')
+LINUX_FIRMWARE_REQUIRED_PROPERTIES = ('hostname', 'machine_uuid', 'serial')
+WINDOWS_FIRMWARE_REQUIRED_PROPERTIES = ('hostname', 'smbios_guid', 'serial')
+FILEVAULT_REQUIRED_PROPERTIES = ('hdd_serial', 'platform_uuid', 'serial')
+LUKS_REQUIRED_PROPERTIES = ('hdd_serial', 'platform_uuid')
+PROVISIONING_REQUIRED_PROPERTIES = ('hdd_serial', 'platform_uuid', 'serial')
 
 CHANGE_OWNER_ACTION = 'ChangeOwner'
 GET_PASSPHRASE_ACTION = 'RetrieveSecret'